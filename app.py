@@ -1,11 +1,31 @@
 import streamlit as st
 import os
+import asyncio
+import functools
+import io
+import hashlib
+import json
+import re
+import time
+import uuid
+import httpx
+import numpy as np
 import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import seaborn as sns
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from pandasai.llm.openai import OpenAI
 from pandasai.smart_dataframe import SmartDataframe
+from prompts import MODEL_ID, can_explain, explanation_messages, pandasai_config, reset_conversation
 
 # Load environment variables from .env file
 load_dotenv()
@@ -46,9 +66,183 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# How long answers are reused for a repeated (data, prompt), and how many streamed answers are kept
+CHAT_CACHE_TTL = 3600
+MAX_CACHED_EXPLANATIONS = 256
+
+# Live SmartDataframes kept per session; each pins its DataFrame, so bound how many and for how long
+SMART_DF_MAX_ENTRIES = 32
+SMART_DF_TTL = 3600
+
+# PandasAI returns failures as an answer starting with this text instead of raising
+PANDASAI_ERROR_PREFIX = "Unfortunately, I was not able to"
+
+# Optional shared answer cache: Redis for keys and small payloads, S3 for payloads over the size limit
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_S3_BUCKET = os.getenv("CACHE_S3_BUCKET", "")
+S3_PAYLOAD_MIN_BYTES = 1_000_000
+SHARED_CACHE_TTL = 86400
+REDIS_TIMEOUT = 1.0
+# S3 payloads live under this prefix. Deployment prerequisite: a bucket lifecycle rule that expires it
+# after SHARED_CACHE_TTL (1 day), so payloads go away with their Redis pointers, e.g.
+#   aws s3api put-bucket-lifecycle-configuration --bucket "$CACHE_S3_BUCKET" --lifecycle-configuration \
+#     '{"Rules": [{"ID": "chat-cache", "Filter": {"Prefix": "chat-cache/"}, "Status": "Enabled", "Expiration": {"Days": 1}}]}'
+CACHE_S3_PREFIX = "chat-cache/"
+
+# Optional streaming backend (server.py); when set, chat turns are answered by it over SSE
+CHAT_BACKEND_URL = os.getenv("CHAT_BACKEND_URL", "").rstrip("/")
+
+# Parsed uploads and preview tables kept in memory; each distinct file pins a copy, so bound how many and for how long
+DF_CACHE_MAX_ENTRIES = 16
+DF_CACHE_TTL = 3600
+
+# CSVs smaller than this are parsed with the default C engine; Arrow's setup cost isn't worth it
+ARROW_MIN_BYTES = 1_000_000
+
+# Row-level charts (scatter/line/hist/box) are drawn from a sample of at most this many rows
+MAX_PLOT_ROWS = 50_000
+
+# Prompt keywords that ask for a visualization, and the chart types plot_and_display_chart can draw,
+# each compiled into one alternation so the prompt is scanned once. Both chart regexes share the stems
+# and suffixes, so every phrase that skips the LLM also resolves to a chart kind
+_PLOT_WORD_RE = re.compile(r"plot|graph|chart|visualize|show")
+_CHART_STEMS = r"bar|pie|line|scatter|box"
+_CHART_SUFFIX = r"\s*(?:chart|plot|graph)s?"
+# Stems alone or with a suffix, spaced or joined ("bar", "bar chart", "barchart", "linegraphs", ...)
+_PLOT_RE = re.compile(rf"\b({_CHART_STEMS}|histogram|hist|heatmap|correlation)(?:{_CHART_SUFFIX}|s)?\b")
+# An explicit chart phrase ("bar chart", "scatterplot", "histogram", ...) that the local plot fully answers
+_CHART_REQUEST_RE = re.compile(rf"\b(?:(?:{_CHART_STEMS}){_CHART_SUFFIX}|(?:histogram|heatmap)s?)\b")
+_CHART_ALIASES = {
+    "histogram": "hist",
+}
+
+# The data preview only ships this many rows to the browser
+PREVIEW_ROWS = 1000
+
+# Correlation heatmaps keep only this many of the highest-variance numeric columns
+MAX_HEATMAP_COLS = 20
+
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "session_id" not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+if "fig" not in st.session_state:
+    # Not registered with pyplot, so charts don't touch its global figure state
+    st.session_state['fig'] = Figure(figsize=(12, 6))
+
+def _optimize_dtypes(df):
+    """Downcast numeric columns and turn low-cardinality strings into categories (charting copies only)"""
+    for name in df.columns:
+        col = df[name]
+        if pd.api.types.is_float_dtype(col):
+            df[name] = pd.to_numeric(col, downcast="float")
+        elif pd.api.types.is_integer_dtype(col):
+            df[name] = pd.to_numeric(col, downcast="integer")
+        elif pd.api.types.is_object_dtype(col) and len(col) > 0:
+            if col.nunique() / len(col) < 0.5:
+                df[name] = col.astype("category")
+    return df
+
+def _dedupe_columns(names):
+    """Header names as the C engine makes them: blanks become 'Unnamed: i', repeats get '.1', '.2', ..."""
+    counts = {}
+    result = []
+    for i, name in enumerate(names):
+        name = name or f"Unnamed: {i}"
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        result.append(name)
+    return result
+
+def _read_csv_arrow(raw_bytes):
+    """Arrow's multithreaded CSV reader, giving the same frame as the C engine for the cases that matter"""
+    # Same NA markers as pandas, in text columns too, so isna()/nunique() don't depend on file size
+    convert_options = pa_csv.ConvertOptions(null_values=sorted(STR_NA_VALUES), strings_can_be_null=True)
+    schema = pa_csv.open_csv(io.BytesIO(raw_bytes), convert_options=convert_options).schema
+    names = _dedupe_columns(schema.names)
+    # Date-like columns stay text like the C engine leaves them
+    convert_options.column_types = {
+        name: pa.string() for name, field in zip(names, schema)
+        if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type) or pa.types.is_time(field.type)
+    }
+    table = pa_csv.read_csv(
+        io.BytesIO(raw_bytes),
+        read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+        convert_options=convert_options
+    )
+    return table.to_pandas()
+
+@st.cache_data(show_spinner=False, max_entries=DF_CACHE_MAX_ENTRIES, ttl=DF_CACHE_TTL)
+def _load_df(raw_bytes: bytes, ext: str) -> pd.DataFrame:
+    """Parse the uploaded file once; reruns with the same bytes hit the cache"""
+    if ext != 'csv':
+        return pd.read_excel(io.BytesIO(raw_bytes))
+    if len(raw_bytes) < ARROW_MIN_BYTES:
+        return pd.read_csv(io.BytesIO(raw_bytes))
+    return _read_csv_arrow(raw_bytes)
+
+def _index_dataframe(df):
+    """Per-file metadata, returned as one dict so session state is updated all at once"""
+    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
+    
+    # One compiled alternation of column names for the listing fast path, matched against the whole
+    # text after "all" (an optional plural "s" allowed); None when there are no columns to match
+    col_lookup = {str(col).lower(): col for col in df.columns}
+    names = sorted(col_lookup, key=len, reverse=True)
+    
+    return {
+        'numeric_cols': numeric_cols,
+        'categorical_cols': categorical_cols,
+        # Compact copy of only the columns the local charts draw; PandasAI keeps the full-precision frame
+        'plot_df': _optimize_dtypes(df[categorical_cols[:1] + numeric_cols[:2]].copy()),
+        'col_lookup': col_lookup,
+        'col_re': re.compile("(" + "|".join(re.escape(name) for name in names) + ")s?") if names else None,
+        # Cheap content hash used to key cached LLM answers to this exact data
+        'df_fingerprint': hashlib.blake2b(
+            pd.util.hash_pandas_object(df, index=True).values.tobytes(), digest_size=16
+        ).hexdigest(),
+    }
+
+def _top_variance_cols(df, cols, k=MAX_HEATMAP_COLS):
+    """The k highest-variance columns, so the heatmap stays legible and O(k^2)"""
+    if len(cols) <= k:
+        return cols
+    return df[cols].var(numeric_only=True).nlargest(k).index.tolist()
+
+def _correlation_matrix(df, cols):
+    """Pearson correlation via np.corrcoef on a float32 array of complete rows; None if fewer than two usable columns"""
+    # All-NaN columns would wipe out every row in the complete-case filter below
+    cols = [col for col in cols if df[col].notna().any()]
+    if len(cols) < 2:
+        return None
+    arr = df[cols].to_numpy(dtype=np.float32, copy=False)
+    arr = arr[~np.isnan(arr).any(axis=1)]
+    if len(arr) < 2:
+        # Too few complete rows for np.corrcoef (one row gives a scalar); pandas pairs columns instead
+        return df[cols].corr()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr_mat = np.corrcoef(arr, rowvar=False)
+    return pd.DataFrame(corr_mat, index=cols, columns=cols)
+
+def chart_kind(prompt_lower):
+    """The chart type the prompt asks for, or None; an explicit chart phrase wins over a chart word elsewhere"""
+    request = _CHART_REQUEST_RE.search(prompt_lower)
+    match = _PLOT_RE.search(request.group(0) if request else prompt_lower)
+    if match is None:
+        return None
+    return _CHART_ALIASES.get(match.group(1), match.group(1))
+
+def _plot_sample(df):
+    """Bound the rows a row-level chart has to draw; aggregated charts use the full frame"""
+    if len(df) <= MAX_PLOT_ROWS:
+        return df
+    return df.sample(MAX_PLOT_ROWS, random_state=0)
 
 def plot_and_display_chart(df, prompt):
     """Function to create and display charts based on the data and user query"""
@@ -56,198 +250,458 @@ def plot_and_display_chart(df, prompt):
         # Set the style for seaborn
         sns.set_style("whitegrid")
         
-        # Create a figure with a larger size
-        plt.figure(figsize=(12, 6))
+        # Reuse this session's figure instead of allocating a new one per chart
+        fig = st.session_state['fig']
+        fig.clear()
+        ax = fig.add_subplot()
         
         # Get column types
-        numeric_cols = df.select_dtypes(include=['int64', 'float64']).columns
-        categorical_cols = df.select_dtypes(include=['object', 'category']).columns
+        numeric_cols = st.session_state['numeric_cols']
+        categorical_cols = st.session_state['categorical_cols']
+        chart_df = st.session_state['plot_df']
+        plot_df = chart_df
         
         # Determine plot type based on user query
-        prompt_lower = prompt.lower()
+        kind = chart_kind(prompt.lower())
         
-        if "bar" in prompt_lower or "barplot" in prompt_lower:
-            if len(categorical_cols) > 0:
-                # Create bar plot for categorical data
-                if len(numeric_cols) > 0:
-                    # If we have numeric columns, use the first one for the y-axis
-                    sns.barplot(x=categorical_cols[0], y=numeric_cols[0], data=df)
-                    plt.title(f'Bar Plot of {numeric_cols[0]} by {categorical_cols[0]}')
+        match kind:
+            case "bar":
+                if len(categorical_cols) > 0:
+                    # Create bar plot for categorical data
+                    if len(numeric_cols) > 0:
+                        # If we have numeric columns, use the first one for the y-axis
+                        sns.barplot(x=categorical_cols[0], y=numeric_cols[0], data=chart_df, ax=ax)
+                        ax.set_title(f'Bar Plot of {numeric_cols[0]} by {categorical_cols[0]}')
+                    else:
+                        # If no numeric columns, create a count plot
+                        sns.countplot(x=categorical_cols[0], data=chart_df, ax=ax)
+                        ax.set_title(f'Count of {categorical_cols[0]}')
                 else:
-                    # If no numeric columns, create a count plot
-                    sns.countplot(x=categorical_cols[0], data=df)
-                    plt.title(f'Count of {categorical_cols[0]}')
-            else:
-                st.warning("No categorical columns found for bar plot")
-                return
-                
-        elif "pie" in prompt_lower or "pie chart" in prompt_lower:
-            if len(categorical_cols) > 0:
-                # Create pie chart for categorical data
+                    st.warning("No categorical columns found for bar plot")
+                    return
+                    
+            case "pie":
+                if len(categorical_cols) > 0:
+                    # Create pie chart for categorical data
+                    if len(numeric_cols) > 0:
+                        # If we have numeric columns, use the first one for values
+                        values = chart_df.groupby(categorical_cols[0], observed=True)[numeric_cols[0]].sum()
+                    else:
+                        # If no numeric columns, use counts
+                        values = chart_df[categorical_cols[0]].value_counts()
+                    
+                    ax.pie(values, labels=values.index, autopct='%1.1f%%')
+                    ax.set_title(f'Pie Chart of {categorical_cols[0]}')
+                else:
+                    st.warning("No categorical columns found for pie chart")
+                    return
+                    
+            case "line":
+                if len(numeric_cols) >= 2:
+                    # Create line plot for numeric data
+                    plot_df = _plot_sample(chart_df)
+                    sns.lineplot(data=plot_df, x=numeric_cols[0], y=numeric_cols[1], ax=ax)
+                    ax.set_title(f'Line Plot of {numeric_cols[1]} vs {numeric_cols[0]}')
+                else:
+                    st.warning("Need at least two numeric columns for line plot")
+                    return
+                    
+            case "scatter":
+                if len(numeric_cols) >= 2:
+                    # Create scatter plot for numeric data
+                    plot_df = _plot_sample(chart_df)
+                    sns.scatterplot(data=plot_df, x=numeric_cols[0], y=numeric_cols[1], ax=ax)
+                    ax.set_title(f'Scatter Plot of {numeric_cols[1]} vs {numeric_cols[0]}')
+                else:
+                    st.warning("Need at least two numeric columns for scatter plot")
+                    return
+                    
+            case "hist":
                 if len(numeric_cols) > 0:
-                    # If we have numeric columns, use the first one for values
-                    values = df.groupby(categorical_cols[0])[numeric_cols[0]].sum()
+                    # Create histogram for numeric data
+                    plot_df = _plot_sample(chart_df)
+                    sns.histplot(data=plot_df, x=numeric_cols[0], kde=True, ax=ax)
+                    ax.set_title(f'Distribution of {numeric_cols[0]}')
                 else:
-                    # If no numeric columns, use counts
-                    values = df[categorical_cols[0]].value_counts()
-                
-                plt.pie(values, labels=values.index, autopct='%1.1f%%')
-                plt.title(f'Pie Chart of {categorical_cols[0]}')
-            else:
-                st.warning("No categorical columns found for pie chart")
-                return
-                
-        elif "line" in prompt_lower or "lineplot" in prompt_lower:
-            if len(numeric_cols) >= 2:
-                # Create line plot for numeric data
-                sns.lineplot(data=df, x=numeric_cols[0], y=numeric_cols[1])
-                plt.title(f'Line Plot of {numeric_cols[1]} vs {numeric_cols[0]}')
-            else:
-                st.warning("Need at least two numeric columns for line plot")
-                return
-                
-        elif "scatter" in prompt_lower or "scatterplot" in prompt_lower:
-            if len(numeric_cols) >= 2:
-                # Create scatter plot for numeric data
-                sns.scatterplot(data=df, x=numeric_cols[0], y=numeric_cols[1])
-                plt.title(f'Scatter Plot of {numeric_cols[1]} vs {numeric_cols[0]}')
-            else:
-                st.warning("Need at least two numeric columns for scatter plot")
-                return
-                
-        elif "hist" in prompt_lower or "histogram" in prompt_lower:
-            if len(numeric_cols) > 0:
-                # Create histogram for numeric data
-                sns.histplot(data=df, x=numeric_cols[0], kde=True)
-                plt.title(f'Distribution of {numeric_cols[0]}')
-            else:
-                st.warning("No numeric columns found for histogram")
-                return
-                
-        elif "box" in prompt_lower or "boxplot" in prompt_lower:
-            if len(numeric_cols) > 0 and len(categorical_cols) > 0:
-                # Create box plot
-                sns.boxplot(x=categorical_cols[0], y=numeric_cols[0], data=df)
-                plt.title(f'Box Plot of {numeric_cols[0]} by {categorical_cols[0]}')
-            else:
-                st.warning("Need both numeric and categorical columns for box plot")
-                return
-                
-        elif "heatmap" in prompt_lower or "correlation" in prompt_lower:
-            if len(numeric_cols) >= 2:
+                    st.warning("No numeric columns found for histogram")
+                    return
+                    
+            case "box":
+                if len(numeric_cols) > 0 and len(categorical_cols) > 0:
+                    # Create box plot
+                    plot_df = _plot_sample(chart_df)
+                    sns.boxplot(x=categorical_cols[0], y=numeric_cols[0], data=plot_df, ax=ax)
+                    ax.set_title(f'Box Plot of {numeric_cols[0]} by {categorical_cols[0]}')
+                else:
+                    st.warning("Need both numeric and categorical columns for box plot")
+                    return
+                    
+            case "heatmap" | "correlation":
                 # Create correlation heatmap
-                correlation = df[numeric_cols].corr()
-                sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0)
-                plt.title('Correlation Heatmap')
-            else:
-                st.warning("Need at least two numeric columns for correlation heatmap")
-                return
-                
-        else:
-            # Default to correlation heatmap if no specific plot type is requested
-            if len(numeric_cols) >= 2:
-                correlation = df[numeric_cols].corr()
-                sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0)
-                plt.title('Correlation Heatmap')
-            else:
-                st.warning("No specific plot type requested and insufficient data for default plot")
-                return
+                correlation = _correlation_matrix(df, _top_variance_cols(df, numeric_cols))
+                if correlation is not None:
+                    sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0, ax=ax)
+                    ax.set_title('Correlation Heatmap')
+                else:
+                    st.warning("Need at least two numeric columns for correlation heatmap")
+                    return
+                    
+            case _:
+                # Default to correlation heatmap if no specific plot type is requested
+                correlation = _correlation_matrix(df, _top_variance_cols(df, numeric_cols))
+                if correlation is not None:
+                    sns.heatmap(correlation, annot=True, cmap='coolwarm', center=0, ax=ax)
+                    ax.set_title('Correlation Heatmap')
+                else:
+                    st.warning("No specific plot type requested and insufficient data for default plot")
+                    return
         
         # Rotate x-axis labels if they're too long
-        plt.xticks(rotation=45, ha='right')
+        plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
         
         # Adjust layout to prevent label cutoff
-        plt.tight_layout()
+        fig.tight_layout()
         
         # Display the plot in Streamlit
-        st.pyplot(plt)
-        
-        # Close the plot to free memory
-        plt.close()
+        st.pyplot(fig)
+        if plot_df is not chart_df:
+            st.caption(f"Sampled to {MAX_PLOT_ROWS:,} rows for responsiveness")
         
     except Exception as e:
         st.error(f"Error creating the plot: {str(e)}")
 
+# Deletes single and double quotes in one str.translate pass
+_QUOTE_TBL = str.maketrans('', '', "'\"")
+
 def format_response(response):
     """Format the response to be more readable"""
     try:
         if isinstance(response, pd.DataFrame):
             return response
         elif isinstance(response, (list, tuple)):
-            return "\n".join([f"- {item}" for item in response])
+            return "\n".join("- " + str(item) for item in response)
         elif isinstance(response, dict):
-            return "\n".join([f"**{key}**: {value}" for key, value in response.items()])
+            return "\n".join(f"**{key}**: {value}" for key, value in response.items())
         elif response is None:
             return "No results found."
         else:
-            # Convert to string and clean up
-            response_str = str(response)
-            # Remove any special characters or formatting issues
-            response_str = response_str.replace("'", "").replace('"', '')
-            return response_str
+            # Convert to string and strip quotes in a single pass
+            return str(response).translate(_QUOTE_TBL)
     except Exception as e:
         return f"Error formatting response: {str(e)}"
 
-def chat_with_csv(df, prompt):
+async def stream_explanation(prompt, answer, placeholder):
+    """Stream a narrative explanation of the answer into the placeholder as tokens arrive"""
+    # Show the raw answer right away, then append the explanation token by token
+    buffer = f"{answer}\n\n"
+    placeholder.markdown(buffer)
+    
+    # The client is bound to this asyncio.run loop, so close it before the loop goes away
+    async with AsyncOpenAI(api_key=openai_api_key) as client:
+        stream = await client.chat.completions.create(
+            model=MODEL_ID,
+            messages=explanation_messages(prompt, answer),
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                buffer += chunk.choices[0].delta.content
+                placeholder.markdown(buffer)
+    return buffer
+
+def upload_to_backend(name, raw_bytes):
+    """Register this session's file with the streaming backend"""
+    response = httpx.post(
+        f"{CHAT_BACKEND_URL}/sessions/{st.session_state['session_id']}",
+        files={"file": (name, raw_bytes)},
+        timeout=60
+    )
+    response.raise_for_status()
+
+def stream_from_backend(prompt, placeholder):
+    """Render the backend's SSE token stream into the placeholder as it arrives"""
+    for attempt in range(2):
+        buffer = ""
+        with httpx.stream(
+            "GET",
+            f"{CHAT_BACKEND_URL}/stream",
+            params={"prompt": prompt, "session": st.session_state['session_id']},
+            headers={"X-OpenAI-Key": openai_api_key},
+            timeout=None
+        ) as response:
+            # The backend drops idle sessions and forgets everything on restart; upload the file again once
+            if response.status_code == 404 and attempt == 0:
+                upload_to_backend(*st.session_state['backend_upload'])
+                continue
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "error":
+                        raise RuntimeError(data)
+                    if event == "done":
+                        break
+                    buffer += data
+                    placeholder.markdown(buffer)
+                elif not line:
+                    event = None
+        return buffer
+
+@st.cache_resource(show_spinner=False, max_entries=SMART_DF_MAX_ENTRIES, ttl=SMART_DF_TTL)
+def _get_smart_df(session_id: str, df_fp: str, api_key: str, _df):
+    """One LLM client and SmartDataframe per (session, data, key), so the HTTP connection pool is reused"""
+    # Per session, and its conversation memory is cleared before every turn (see run_pandas_ai)
+    llm = OpenAI(id=MODEL_ID, api_token=api_key)
+    return SmartDataframe(_df, config=pandasai_config(llm))
+
+@st.cache_resource(show_spinner=False)
+def _get_redis():
+    """Shared Redis client, or None when REDIS_URL isn't configured"""
+    if not REDIS_URL:
+        return None
+    import redis
+    # Short timeouts so an unreachable Redis degrades to a normal query instead of hanging the turn
+    return redis.Redis.from_url(
+        REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT
+    )
+
+@st.cache_resource(show_spinner=False)
+def _get_s3():
+    """Shared S3 client, or None when CACHE_S3_BUCKET isn't configured"""
+    if not CACHE_S3_BUCKET:
+        return None
+    import boto3
+    return boto3.client("s3")
+
+def _encode_result(value):
+    """Serialize a formatted answer without pickle: UTF-8 for text, Arrow IPC for DataFrames"""
+    if isinstance(value, pd.DataFrame):
+        return b"arrow:" + pa.ipc.serialize_pandas(value).to_pybytes()
+    return b"text:" + value.encode("utf-8")
+
+def _decode_result(payload):
+    """Inverse of _encode_result"""
+    kind, _, data = payload.partition(b":")
+    if kind == b"arrow":
+        return pa.ipc.deserialize_pandas(data)
+    if kind == b"text":
+        return data.decode("utf-8")
+    raise ValueError(f"Unknown cached payload type: {kind!r}")
+
+def _store_payload(key, value):
+    """Encode a result; large ones go to S3 and Redis only keeps a pointer"""
+    payload = _encode_result(value)
+    s3 = _get_s3()
+    if s3 is not None and len(payload) >= S3_PAYLOAD_MIN_BYTES:
+        s3.put_object(Bucket=CACHE_S3_BUCKET, Key=CACHE_S3_PREFIX + key, Body=payload)
+        return b"s3:" + (CACHE_S3_PREFIX + key).encode()
+    return payload
+
+def _load_payload(stored):
+    """Inverse of _store_payload"""
+    kind, _, data = stored.partition(b":")
+    if kind == b"s3":
+        stored = _get_s3().get_object(Bucket=CACHE_S3_BUCKET, Key=data.decode())["Body"].read()
+    return _decode_result(stored)
+
+def shared_cache(ttl):
+    """Cache a (fp, prompt, ...) function in Redis/S3 so answers survive restarts and are shared across replicas"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(fp, prompt, *args):
+            client = _get_redis()
+            if client is None:
+                return func(fp, prompt, *args)
+            
+            key = "chat:" + hashlib.blake2b(f"{fp}|{MODEL_ID}|{prompt}".encode(), digest_size=16).hexdigest()
+            try:
+                stored = client.get(key)
+                if stored is not None:
+                    return _load_payload(stored)
+            except Exception as e:
+                st.warning(f"Shared cache unavailable, running the query: {str(e)}")
+                return func(fp, prompt, *args)
+            
+            result = func(fp, prompt, *args)
+            try:
+                client.set(key, _store_payload(key, result), ex=ttl)
+            except Exception as e:
+                st.warning(f"Could not store the answer in the shared cache: {str(e)}")
+            return result
+        return wrapper
+    return decorator
+
+@shared_cache(ttl=SHARED_CACHE_TTL)
+def run_pandas_ai(fp, prompt, api_key, df, session_id):
+    """Ask PandasAI; format here so the result is a plain string or DataFrame"""
+    pandas_ai = _get_smart_df(session_id, fp, api_key, df)
+    # Answers are cached by (data, prompt), so they must not depend on earlier turns
+    reset_conversation(pandas_ai)
+    result = pandas_ai.chat(prompt)
+    
+    # PandasAI reports failures (bad key, rate limit, outage) as a normal answer; raise so no cache keeps them
+    if isinstance(result, str) and result.startswith(PANDASAI_ERROR_PREFIX):
+        raise RuntimeError(result)
+    return format_response(result)
+
+@st.cache_data(ttl=CHAT_CACHE_TTL, show_spinner=False)
+def _chat_cached(fp: str, prompt: str, api_key: str, _df, _session_id):
+    """Run PandasAI once per (data fingerprint, prompt); repeats are served from the cache"""
+    return run_pandas_ai(fp, prompt, api_key, _df, _session_id)
+
+@st.cache_resource(show_spinner=False)
+def _explanation_cache():
+    """Finished streamed answers by (data fingerprint, prompt) -> (time stored, text)"""
+    return {}
+
+def _cached_explanation(fp, prompt):
+    """A streamed answer from an earlier turn on the same data, if it is still fresh"""
+    entry = _explanation_cache().get((fp, prompt))
+    if entry is None or time.monotonic() - entry[0] > CHAT_CACHE_TTL:
+        return None
+    return entry[1]
+
+def _remember_explanation(fp, prompt, text):
+    """Keep a finished streamed answer, dropping the oldest once the cache is full"""
+    cache = _explanation_cache()
+    if len(cache) >= MAX_CACHED_EXPLANATIONS:
+        cache.pop(next(iter(cache)), None)
+    cache[(fp, prompt)] = (time.monotonic(), text)
+
+def chat_with_csv(df, prompt, placeholder):
     """Function to handle chat with CSV using PandasAI"""
     try:
-        llm = OpenAI(id="gpt-4o", api_token=openai_api_key)
-        
-        # Enhanced prompt for better responses
-        enhanced_prompt = f"""
-        Please analyze the data and provide a clear, well-structured response to the following question:
-        {prompt}
-        
-        Guidelines for your response:
-        1. Start with a brief summary of your findings
-        2. Use clear, concise language
-        3. Format numbers and statistics appropriately
-        4. If showing calculations, explain the steps
-        5. If creating visualizations, use seaborn for plotting
-        6. End with key takeaways or recommendations
-        
-        For list queries (like 'what are all item names'), please return a simple list of items.
-        For statistical queries, please include both the numbers and their interpretation.
-        
-        Please structure your response in a clear, organized manner.
-        """
-        
-        pandas_ai = SmartDataframe(
-            df, 
-            config={
-                "llm": llm, 
-                "save_charts": False,
-                "verbose": True,
-                "enforce_privacy": True,
-                "enable_cache": True,
-                "use_error_correction_framework": True,
-                "max_retries": 3,
-                "custom_instructions": enhanced_prompt
-            }
-        )
-        
         # Handle specific types of queries
         if "what are all" in prompt.lower() or "list all" in prompt.lower():
             # For listing queries, try to get a simple list
             try:
                 # Get unique values from the relevant column
-                column_name = prompt.lower().split("all")[-1].strip().replace("names", "name").replace("items", "item")
-                if column_name in df.columns:
+                # Only when everything after "all" names a column; a column mentioned elsewhere may be a filter
+                col_re = st.session_state['col_re']
+                match = col_re.fullmatch(prompt.lower().split("all")[-1].strip()) if col_re else None
+                column_name = st.session_state['col_lookup'][match.group(1)] if match else None
+                if column_name is not None:
                     result = df[column_name].unique().tolist()
                     return format_response(result)
             except Exception as e:
                 st.warning(f"Could not get simple list, falling back to full analysis: {str(e)}")
         
-        result = pandas_ai.chat(prompt)
-        
-        # Check if the prompt is about plotting
-        if any(word in prompt.lower() for word in ["plot", "graph", "chart", "visualize", "show"]):
+        # An explicit chart request is fully served by the local plot, as long as it can draw that kind; skip the LLM
+        is_plot = _PLOT_WORD_RE.search(prompt.lower()) is not None
+        if _CHART_REQUEST_RE.search(prompt.lower()) and chart_kind(prompt.lower()) is not None:
             plot_and_display_chart(df, prompt)
-            
-        return format_response(result)
+            return "Rendered the requested chart."
+        
+        if CHAT_BACKEND_URL:
+            answer = stream_from_backend(prompt, placeholder)
+            if is_plot:
+                plot_and_display_chart(df, prompt)
+            return answer
+        
+        fp = st.session_state['df_fingerprint']
+        session_id = st.session_state['session_id']
+        explained = _cached_explanation(fp, prompt)
+        if explained is not None:
+            if is_plot:
+                plot_and_display_chart(df, prompt)
+            return explained
+        
+        if is_plot:
+            # The chart only needs df: draw it on the script thread while PandasAI runs in the background
+            ctx = get_script_run_ctx()
+            with ThreadPoolExecutor(max_workers=1, initializer=lambda: add_script_run_ctx(ctx=ctx)) as executor:
+                future = executor.submit(_chat_cached, fp, prompt, openai_api_key, df, session_id)
+                plot_and_display_chart(df, prompt)
+                answer = future.result()
+        else:
+            answer = _chat_cached(fp, prompt, openai_api_key, df, session_id)
+        
+        # Row-level answers stay local when privacy is enforced
+        if isinstance(answer, pd.DataFrame) or not can_explain(answer):
+            return answer
+        
+        # PandasAI handles the code execution; only the explanation is streamed
+        explained = asyncio.run(stream_explanation(prompt, answer, placeholder))
+        _remember_explanation(fp, prompt, explained)
+        return explained
     except Exception as e:
         return f"Error processing query: {str(e)}"
 
+@st.cache_data(show_spinner=False, max_entries=DF_CACHE_MAX_ENTRIES, ttl=DF_CACHE_TTL)
+def _preview_table(fp: str, _df):
+    """Convert the preview rows to Arrow once per uploaded file instead of on every rerun"""
+    head = _df.head(PREVIEW_ROWS)
+    try:
+        return pa.Table.from_pandas(head)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type columns (e.g. 101 and 'A12'); st.dataframe casts those to strings itself
+        return head
+
+def _to_arrow_bytes(df):
+    """Serialize a DataFrame answer to Arrow IPC bytes once, when it is added to the history; None if Arrow can't hold it"""
+    try:
+        # Turn a meaningful index (filtered rows, groupby keys) into leading columns so the bare table shows it
+        if not isinstance(df.index, pd.RangeIndex):
+            df = df.reset_index()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (ValueError, pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type columns or clashing column names; keep the DataFrame and let st.dataframe cope
+        return None
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _arrow_table(buf: bytes) -> pa.Table:
+    """Arrow table for a history message; reading the IPC stream is near zero-copy, so it isn't cached"""
+    return pa.ipc.open_stream(buf).read_all()
+
+@st.fragment
+def _chat_fragment(df):
+    """Chat history and input; reruns on its own so the rest of the page isn't rebuilt"""
+    # Display chat messages
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            if message.get("content_type") == "arrow":
+                st.dataframe(_arrow_table(message["content"]), use_container_width=True)
+            elif isinstance(message["content"], pd.DataFrame):
+                st.dataframe(message["content"], use_container_width=True)
+            else:
+                st.markdown(message["content"])
+    
+    # Chat input
+    if prompt := st.chat_input("Ask a question about your data"):
+        # Add user message to chat history
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        
+        # Display user message
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        
+        # Get bot response
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            with st.spinner("Analyzing your data..."):
+                try:
+                    response = chat_with_csv(df, prompt, placeholder)
+                    buf = _to_arrow_bytes(response) if isinstance(response, pd.DataFrame) else None
+                    if buf is not None:
+                        placeholder.dataframe(_arrow_table(buf), use_container_width=True)
+                        st.session_state.messages.append({"role": "assistant", "content_type": "arrow", "content": buf})
+                    elif isinstance(response, pd.DataFrame):
+                        placeholder.dataframe(response, use_container_width=True)
+                        st.session_state.messages.append({"role": "assistant", "content": response})
+                    else:
+                        placeholder.markdown(response)
+                        st.session_state.messages.append({"role": "assistant", "content": response})
+                except Exception as e:
+                    error_msg = f"Error processing query: {str(e)}"
+                    st.error(error_msg)
+                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+
 # Sidebar for file upload and API key
 with st.sidebar:
     st.header("⚙️ Settings")
@@ -260,17 +714,20 @@ with st.sidebar:
         try:
             # Read the file based on its extension
             file_extension = uploaded_file.name.split('.')[-1].lower()
-            if file_extension == 'csv':
-                df = pd.read_csv(uploaded_file)
-            elif file_extension in ['xlsx', 'xls']:
-                df = pd.read_excel(uploaded_file)
+            if file_extension in ['csv', 'xlsx', 'xls']:
+                # Only parse and index again when a different file is uploaded
+                if st.session_state.get('file_id') != uploaded_file.file_id:
+                    df = _load_df(uploaded_file.getvalue(), file_extension)
+                    metadata = _index_dataframe(df)
+                    if CHAT_BACKEND_URL:
+                        upload_to_backend(uploaded_file.name, uploaded_file.getvalue())
+                        # Kept so the file can be sent again if the backend has dropped the session
+                        metadata['backend_upload'] = (uploaded_file.name, uploaded_file.getvalue())
+                    # Only switch over once every step succeeded, so df and its metadata never disagree
+                    st.session_state.update(metadata, df=df, file_id=uploaded_file.file_id)
+                st.success(f"Successfully uploaded: {uploaded_file.name}")
             else:
                 st.error("Unsupported file format. Please upload a CSV or Excel file.")
-                df = None
-                
-            if df is not None:
-                st.session_state['df'] = df
-                st.success(f"Successfully uploaded: {uploaded_file.name}")
         except Exception as e:
             st.error(f"Error reading file: {str(e)}")
 
@@ -284,7 +741,9 @@ if 'df' in st.session_state:
     
     # Display data preview at the top using expander
     with st.expander("📋 Click to view Data Preview", expanded=True):
-        st.dataframe(df, use_container_width=True)
+        st.dataframe(_preview_table(st.session_state['df_fingerprint'], df), use_container_width=True, height=400)
+        if len(df) > PREVIEW_ROWS:
+            st.caption(f"Showing first {PREVIEW_ROWS:,} rows of {len(df):,}")
     
     # Add a separator
     st.markdown("---")
@@ -292,36 +751,6 @@ if 'df' in st.session_state:
     # Chat interface below
     st.subheader("💬 Chat with your Data")
     
-    # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            if isinstance(message["content"], pd.DataFrame):
-                st.dataframe(message["content"], use_container_width=True)
-            else:
-                st.markdown(message["content"])
-    
-    # Chat input
-    if prompt := st.chat_input("Ask a question about your data"):
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.markdown(prompt)
-        
-        # Get bot response
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing your data..."):
-                try:
-                    response = chat_with_csv(df, prompt)
-                    if isinstance(response, pd.DataFrame):
-                        st.dataframe(response, use_container_width=True)
-                    else:
-                        st.markdown(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    error_msg = f"Error processing query: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+    _chat_fragment(df)
 else:
     st.info("👈 Please upload a CSV file using the sidebar to begin analysis.")
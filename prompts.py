@@ -0,0 +1,71 @@
+# Prompt text and model settings shared by the Streamlit app (app.py) and the streaming backend (server.py)
+
+# Model used for both the PandasAI code path and the streamed explanation
+MODEL_ID = "gpt-4o"
+
+# Mirrors PandasAI's "enforce_privacy": when on, answers that may hold row values are not sent back for an explanation
+ENFORCE_PRIVACY = True
+
+# Response guidelines; the same for every question, so they can live in the cached SmartDataframe config
+RESPONSE_GUIDELINES = """
+        Guidelines for your response:
+        1. Start with a brief summary of your findings
+        2. Use clear, concise language
+        3. Format numbers and statistics appropriately
+        4. If showing calculations, explain the steps
+        5. If creating visualizations, use seaborn for plotting
+        6. End with key takeaways or recommendations
+
+        For list queries (like 'what are all item names'), please return a simple list of items.
+        For statistical queries, please include both the numbers and their interpretation.
+
+        Please structure your response in a clear, organized manner.
+        """
+
+def build_enhanced_prompt(prompt):
+    """Wrap the user's question with the response guidelines"""
+    return f"""
+        Please analyze the data and provide a clear, well-structured response to the following question:
+        {prompt}
+        {RESPONSE_GUIDELINES}"""
+
+def pandasai_config(llm):
+    """SmartDataframe config used by both the app and the backend"""
+    return {
+        "llm": llm,
+        "save_charts": False,
+        "verbose": True,
+        "enforce_privacy": ENFORCE_PRIVACY,
+        "enable_cache": True,
+        "use_error_correction_framework": True,
+        "max_retries": 3,
+        "custom_instructions": RESPONSE_GUIDELINES
+    }
+
+def reset_conversation(smart_df):
+    """Clear a reused SmartDataframe's conversation memory so each answer depends only on the data and the question"""
+    agent = getattr(smart_df, "_agent", None)
+    if agent is not None:
+        # pandasai 2.x
+        agent.start_new_conversation()
+    else:
+        # pandasai 1.x
+        smart_df.lake.clear_memory()
+
+def explanation_messages(prompt, answer):
+    """Chat messages asking the model to explain an analysis result"""
+    return [
+        {"role": "system", "content": build_enhanced_prompt(prompt)},
+        {"role": "user", "content": f"The analysis produced this result:\n{answer}\n\nExplain it."}
+    ]
+
+def can_explain(answer):
+    """Whether the answer may be sent to the model for an explanation under ENFORCE_PRIVACY"""
+    if not ENFORCE_PRIVACY:
+        return True
+    # Only a bare number (an aggregate) is safe; lists and free text can carry raw data values
+    try:
+        float(str(answer).replace(",", ""))
+    except ValueError:
+        return False
+    return True
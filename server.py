@@ -0,0 +1,137 @@
+"""Streaming chat backend for the Data Analysis Chatbot.
+
+Run with ``uvicorn server:app`` and point the Streamlit app at it with
+``CHAT_BACKEND_URL=http://localhost:8000``. Chat turns are answered over
+Server-Sent Events so many sessions can stream concurrently from one async server.
+"""
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+import pandas as pd
+from fastapi import FastAPI, File, Header, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI
+from pandasai.llm.openai import OpenAI
+from pandasai.smart_dataframe import SmartDataframe
+from prompts import MODEL_ID, can_explain, explanation_messages, pandasai_config, reset_conversation
+
+app = FastAPI(title="Data Analysis Chatbot backend")
+
+# Sessions idle longer than this are dropped, and at most MAX_SESSIONS are kept (least recently used first)
+SESSION_TTL = 3600
+MAX_SESSIONS = 64
+
+# DataFrame answers are sent as text, capped at this many rows
+MAX_ANSWER_ROWS = 50
+
+# Uploaded DataFrames per chat session as session_id -> (last used, df), plus their SmartDataframes
+# (in-memory, single process)
+SESSIONS = OrderedDict()
+SMART_DFS = {}
+
+def _sse(data, event=None):
+    """Format one Server-Sent Event; data is JSON-encoded so newlines survive"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def _drop_session(session_id):
+    """Forget a session's DataFrame and every SmartDataframe built on it"""
+    SESSIONS.pop(session_id, None)
+    for key in [key for key in SMART_DFS if key[0] == session_id]:
+        del SMART_DFS[key]
+
+def _evict_sessions():
+    """Drop idle sessions, then the least recently used ones beyond MAX_SESSIONS"""
+    now = time.monotonic()
+    for session_id, (last_used, _) in list(SESSIONS.items()):
+        if now - last_used > SESSION_TTL:
+            _drop_session(session_id)
+    while len(SESSIONS) > MAX_SESSIONS:
+        _drop_session(next(iter(SESSIONS)))
+
+def _touch_session(session_id):
+    """Mark a session as just used so eviction keeps it"""
+    _, df = SESSIONS[session_id]
+    SESSIONS[session_id] = (time.monotonic(), df)
+    SESSIONS.move_to_end(session_id)
+
+def _get_smart_df(session_id, api_key):
+    """One LLM client and SmartDataframe per (session, key), reused across turns"""
+    key = (session_id, api_key)
+    if key not in SMART_DFS:
+        llm = OpenAI(id=MODEL_ID, api_token=api_key)
+        SMART_DFS[key] = SmartDataframe(SESSIONS[session_id][1], config=pandasai_config(llm))
+    return SMART_DFS[key]
+
+def _format_answer(result):
+    """Render a PandasAI result as markdown; DataFrames become a capped fixed-width table"""
+    if isinstance(result, pd.DataFrame):
+        table = result.head(MAX_ANSWER_ROWS).to_string()
+        if len(result) > MAX_ANSWER_ROWS:
+            table += f"\n... {len(result):,} rows in total"
+        return f"```\n{table}\n```"
+    return str(result)
+
+async def token_stream(session_id, prompt, api_key):
+    """Run PandasAI off the event loop, then stream the answer and its explanation"""
+    try:
+        pandas_ai = _get_smart_df(session_id, api_key)
+        # Stateless turns, like the app, so an answer depends only on the data and the prompt
+        reset_conversation(pandas_ai)
+        result = await run_in_threadpool(pandas_ai.chat, prompt)
+        answer = _format_answer(result)
+        yield _sse(f"{answer}\n\n")
+
+        # Row-level answers stay local when privacy is enforced
+        if not isinstance(result, pd.DataFrame) and can_explain(answer):
+            async with AsyncOpenAI(api_key=api_key) as client:
+                stream = await client.chat.completions.create(
+                    model=MODEL_ID,
+                    messages=explanation_messages(prompt, answer),
+                    stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield _sse(chunk.choices[0].delta.content)
+        yield _sse(None, event="done")
+    except Exception as e:
+        yield _sse(f"Error processing query: {str(e)}", event="error")
+
+def _parse_upload(raw, ext):
+    """Read an uploaded CSV or Excel file into a DataFrame"""
+    if ext == 'csv':
+        return pd.read_csv(io.BytesIO(raw))
+    return pd.read_excel(io.BytesIO(raw))
+
+@app.post("/sessions/{session_id}")
+async def upload(session_id: str, file: UploadFile = File(...)):
+    """Store the session's DataFrame; replaces any earlier upload"""
+    raw = await file.read()
+    ext = file.filename.split('.')[-1].lower()
+    if ext not in ['csv', 'xlsx', 'xls']:
+        raise HTTPException(status_code=415, detail="Unsupported file format")
+    # Parsing is CPU-bound; keep it off the event loop so other sessions' streams keep flowing
+    df = await run_in_threadpool(_parse_upload, raw, ext)
+
+    _drop_session(session_id)
+    SESSIONS[session_id] = (time.monotonic(), df)
+    _evict_sessions()
+    return {"rows": len(df), "columns": len(df.columns)}
+
+@app.get("/stream")
+async def stream(prompt: str, session: str, x_openai_key: str | None = Header(default=None)):
+    """Answer one chat turn as a text/event-stream of JSON-encoded tokens"""
+    _evict_sessions()
+    if session not in SESSIONS:
+        raise HTTPException(status_code=404, detail="Unknown session; upload a file first")
+    _touch_session(session)
+    api_key = x_openai_key or os.getenv("OPENAI_API_KEY", "")
+    return StreamingResponse(
+        token_stream(session, prompt, api_key),
+        media_type="text/event-stream",
+        # Stop reverse proxies (e.g. nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )